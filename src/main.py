@@ -3,7 +3,7 @@ import numpy as np
 import os
 import sys
 import tensorflow as tf
-from functools import reduce
+from collections import Counter
 from itertools import chain
 from memn2n.memn2n_dialog_generator import MemN2NGeneratorDialog
 from operator import itemgetter
@@ -44,6 +44,10 @@ class chatBot(object):
         # Define MemN2N + Generator Model
         config = tf.ConfigProto()
         config.gpu_options.allow_growth = True
+        if args.xla_jit:
+            # let XLA fuse the attention score/mask/softmax chains into
+            # single kernels instead of one launch per op
+            config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
         glob['session'] = tf.Session(config=config)
         glob['optimizer'] = tf.train.AdamOptimizer(learning_rate=args.learning_rate, epsilon=args.epsilon)
         self.model = MemN2NGeneratorDialog(args, glob)
@@ -53,8 +57,13 @@ class chatBot(object):
         '''
                 Get vocabulary from the Train data
         '''
-        vocab = reduce(lambda x, y: x | y, (set(list(chain.from_iterable(s)) + q) for s, q, a, _, _ in data))
-        vocab = sorted(vocab)
+        vocab = Counter()
+        for s, q, _, _, _ in data:
+            vocab.update(chain.from_iterable(s))
+            vocab.update(q)
+        # most frequent tokens get the smallest ids, keeping the hot
+        # embedding rows packed together (ties broken alphabetically)
+        vocab = sorted(vocab, key=lambda w: (-vocab[w], w))
         glob['word_idx'] = dict((c, i + 2) for i, c in enumerate(vocab))
         glob['word_idx'][''] = 0
         glob['word_idx']['UNK'] = 1
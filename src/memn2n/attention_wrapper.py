@@ -21,6 +21,7 @@ from __future__ import print_function
 import collections
 import functools
 import math
+import os
 import numpy as np
 import tensorflow as tf
 
@@ -53,11 +54,25 @@ __all__ = [
 
 _zero_state_tensors = rnn_cell_impl._zero_state_tensors  # pylint: disable=protected-access
 
+# Runtime shape/value asserts cost extra kernel launches and their control
+# dependencies block op fusion on the hot decode path; set
+# BOSSNET_DEBUG_ASSERTS=1 to turn them back on when debugging.
+_ENABLE_ASSERTS = os.environ.get("BOSSNET_DEBUG_ASSERTS", "0") != "0"
+
 
 class AttentionMechanism(object):
     pass
 
 
+def _dim(tensor, axis):
+    """Size of `tensor` along `axis`: a Python int when statically known,
+    otherwise a scalar tensor."""
+    value = tensor.get_shape()[axis].value
+    if value is not None:
+        return value
+    return array_ops.shape(tensor)[axis]
+
+
 def _prepare_memory(memory, memory_sequence_length, check_inner_dims_defined):
     """Convert to tensor and possibly mask `memory`.
 
@@ -75,8 +90,16 @@ def _prepare_memory(memory, memory_sequence_length, check_inner_dims_defined):
       ValueError: If `check_inner_dims_defined` is `True` and not
         `memory.shape[2:].is_fully_defined()`.
     """
-    memory = nest.map_structure(
-        lambda m: ops.convert_to_tensor(m, name="memory"), memory)
+    # the memories here are plain tensors in practice; skip the nest
+    # traversal machinery for that common case
+    is_single = not nest.is_sequence(memory)
+    if is_single:
+        memory = ops.convert_to_tensor(memory, name="memory")
+        first_memory = memory
+    else:
+        memory = nest.map_structure(
+            lambda m: ops.convert_to_tensor(m, name="memory"), memory)
+        first_memory = nest.flatten(memory)[0]
     if memory_sequence_length is not None:
         memory_sequence_length = ops.convert_to_tensor(
             memory_sequence_length, name="memory_sequence_length")
@@ -85,35 +108,52 @@ def _prepare_memory(memory, memory_sequence_length, check_inner_dims_defined):
             if not m.get_shape()[2:].is_fully_defined():
                 raise ValueError("Expected memory %s to have fully defined inner dims, "
                                  "but saw shape: %s" % (m.name, m.get_shape()))
-        nest.map_structure(_check_dims, memory)
+        if is_single:
+            _check_dims(memory)
+        else:
+            nest.map_structure(_check_dims, memory)
     if memory_sequence_length is None:
         seq_len_mask = None
     else:
         seq_len_mask = array_ops.sequence_mask(
             memory_sequence_length,
-            maxlen=array_ops.shape(nest.flatten(memory)[0])[1],
-            dtype=nest.flatten(memory)[0].dtype)
-        seq_len_batch_size = (
-            memory_sequence_length.shape[0].value
-            or array_ops.shape(memory_sequence_length)[0])
+            maxlen=array_ops.shape(first_memory)[1],
+            dtype=first_memory.dtype)
+        seq_len_batch_size = _dim(memory_sequence_length, 0)
 
     def _maybe_mask(m, seq_len_mask):
-        rank = m.get_shape().ndims
-        rank = rank if rank is not None else array_ops.rank(m)
-        extra_ones = array_ops.ones(rank - 2, dtype=dtypes.int32)
-        m_batch_size = m.shape[0].value or array_ops.shape(m)[0]
-        if memory_sequence_length is not None:
-            message = ("memory_sequence_length and memory tensor batch sizes do not "
-                       "match.")
-            with ops.control_dependencies([
-                check_ops.assert_equal(
-                    seq_len_batch_size, m_batch_size, message=message)]):
+        if memory_sequence_length is None:
+            return m
+        message = ("memory_sequence_length and memory tensor batch sizes do not "
+                   "match.")
+        m_batch_size = _dim(m, 0)
+        if isinstance(seq_len_batch_size, int) and isinstance(m_batch_size, int):
+            # both batch sizes are statically known; check now and skip the
+            # runtime assert
+            if seq_len_batch_size != m_batch_size:
+                raise ValueError(message)
+            checks = []
+        elif _ENABLE_ASSERTS:
+            checks = [check_ops.assert_equal(
+                seq_len_batch_size, m_batch_size, message=message)]
+        else:
+            checks = []
+        with ops.control_dependencies(checks):
+            rank = m.get_shape().ndims
+            if rank is not None:
+                # static rank: grow the mask with free axes, no dynamic
+                # rank/ones/concat ops in the graph
+                for _ in range(rank - 2):
+                    seq_len_mask = array_ops.expand_dims(seq_len_mask, -1)
+            else:
+                extra_ones = array_ops.ones(
+                    array_ops.rank(m) - 2, dtype=dtypes.int32)
                 seq_len_mask = array_ops.reshape(
                     seq_len_mask,
                     array_ops.concat((array_ops.shape(seq_len_mask), extra_ones), 0))
-                return m * seq_len_mask
-        else:
-            return m
+            return m * seq_len_mask
+    if is_single:
+        return _maybe_mask(memory, seq_len_mask)
     return nest.map_structure(lambda m: _maybe_mask(m, seq_len_mask), memory)
 
 
@@ -121,12 +161,18 @@ def _maybe_mask_score(score, memory_sequence_length, score_mask_value):
     if memory_sequence_length is None:
         return score
     message = ("All values in memory_sequence_length must greater than zero.")
-    with ops.control_dependencies(
-            [check_ops.assert_positive(memory_sequence_length, message=message)]):
+    checks = ([check_ops.assert_positive(memory_sequence_length, message=message)]
+              if _ENABLE_ASSERTS else [])
+    with ops.control_dependencies(checks):
         score_mask = array_ops.sequence_mask(
-            memory_sequence_length, maxlen=array_ops.shape(score)[1])
-        score_mask_values = score_mask_value * array_ops.ones_like(score)
-        return array_ops.where(score_mask, score, score_mask_values)
+            memory_sequence_length, maxlen=array_ops.shape(score)[1],
+            dtype=score.dtype)
+        # an additive bias avoids the ones_like allocation and select kernel;
+        # -inf is swapped for the dtype minimum since 0 * inf would yield NaN
+        # at the valid positions
+        if np.isinf(score_mask_value):
+            score_mask_value = score.dtype.min
+        return score + (1.0 - score_mask) * score_mask_value
 
 
 class _BaseAttentionMechanism(AttentionMechanism):
@@ -148,6 +194,7 @@ class _BaseAttentionMechanism(AttentionMechanism):
                  word_memory_layer=None,
                  check_inner_dims_defined=True,
                  score_mask_value=float("-inf"),
+                 compute_dtype=None,
                  name=None):
         """Construct base AttentionMechanism class.
 
@@ -173,6 +220,9 @@ class _BaseAttentionMechanism(AttentionMechanism):
           score_mask_value: (optional): The mask value for score before passing into
             `probability_fn`. The default is -inf. Only used if
             `memory_sequence_length` is not None.
+          compute_dtype: (optional) A `DType`.  If set, the score matmuls run
+            against keys/values cast to this dtype (e.g. `tf.float16`) while
+            alignments stay in the memory dtype.
           name: Name to use when creating ops.
         """
         if (query_layer is not None
@@ -191,7 +241,8 @@ class _BaseAttentionMechanism(AttentionMechanism):
                             type(probability_fn).__name__)
         self._probability_fn = lambda score: (  # pylint:disable=g-long-lambda
             probability_fn(
-                _maybe_mask_score(score, line_memory_sequence_length, score_mask_value)))
+                score if self._score_mask_bias is None
+                else score + self._score_mask_bias))
         with ops.name_scope(
                 name, "BaseAttentionMechanismInit", nest.flatten(line_memory)):
             self._values = _prepare_memory(
@@ -206,10 +257,65 @@ class _BaseAttentionMechanism(AttentionMechanism):
             self._word_keys = (
                 word_memory_layer(self._word_values) if self._word_memory_layer  # pylint: disable=not-callable
                 else self._values)
-            self._batch_size = (self._keys.shape[0].value or array_ops.shape(self._keys)[0])
-            self._alignments_size = (self._keys.shape[1].value or array_ops.shape(self._keys)[1])
-            self._embedding_size = (self._keys.shape[2].value or array_ops.shape(self._keys)[2])
-            self._word_alignments_size = (self._word_values.shape[2].value or array_ops.shape(self._word_values)[2])
+            # resolve each dimension to a Python int when statically known;
+            # a single Shape op backs whichever dims remain dynamic
+            keys_shape = self._keys.get_shape().as_list()
+            keys_shape_dynamic = (
+                array_ops.shape(self._keys) if None in keys_shape[:3] else None)
+            self._batch_size = (keys_shape[0] if keys_shape[0] is not None
+                                else keys_shape_dynamic[0])
+            self._alignments_size = (keys_shape[1] if keys_shape[1] is not None
+                                     else keys_shape_dynamic[1])
+            self._embedding_size = (keys_shape[2] if keys_shape[2] is not None
+                                    else keys_shape_dynamic[2])
+            self._word_alignments_size = _dim(self._word_values, 2)
+            # the memory lengths are fixed across decode steps, so the
+            # additive score-mask bias is built once here instead of once
+            # per step inside the probability_fn
+            if line_memory_sequence_length is not None:
+                message = ("All values in memory_sequence_length must greater than zero.")
+                checks = ([check_ops.assert_positive(
+                    line_memory_sequence_length, message=message)]
+                    if _ENABLE_ASSERTS else [])
+                with ops.control_dependencies(checks):
+                    seq_len_mask = array_ops.sequence_mask(
+                        line_memory_sequence_length,
+                        maxlen=self._alignments_size,
+                        dtype=self._keys.dtype)
+                if np.isinf(score_mask_value):
+                    score_mask_value = self._keys.dtype.min
+                self._score_mask_bias = (1.0 - seq_len_mask) * score_mask_value
+            else:
+                self._score_mask_bias = None
+            # flatten the word memory to [batch, lines * words, depth] once;
+            # every per-step scoring path consumes this layout
+            word_depth = self._word_values.get_shape().as_list()[3]
+            if word_depth is not None:
+                self._word_values_flat = tf.reshape(
+                    self._word_values, [self._batch_size, -1, word_depth])
+            else:
+                self._word_values_flat = tf.reshape(
+                    self._word_values,
+                    tf.stack([self._batch_size, -1,
+                              array_ops.shape(self._word_values)[3]]))
+            # optional reduced-precision copies for the score matmuls
+            self._compute_dtype = compute_dtype
+            if compute_dtype is not None:
+                self._keys_lp = math_ops.cast(self._keys, compute_dtype)
+                self._word_values_lp = math_ops.cast(self._word_values_flat, compute_dtype)
+            else:
+                self._keys_lp = self._keys
+                self._word_values_lp = self._word_values_flat
+            # when the projected line keys and the raw word values share a
+            # depth (num_units == embedding size, as in this model), both
+            # score matmuls can be served by one fused GEMM against the
+            # concatenation, so the query is read from memory once
+            if (word_depth is not None and isinstance(self._embedding_size, int)
+                    and word_depth == self._embedding_size):
+                self._combined_keys = tf.concat(
+                    [self._keys, self._word_values_flat], 1)
+            else:
+                self._combined_keys = None
 
     @property
     def memory_layer(self):
@@ -307,27 +413,17 @@ def _luong_score(query, keys, scale):
             % (query, depth, keys, key_units, key_units))
     dtype = query.dtype
 
-    # Reshape from [batch_size, depth] to [batch_size, 1, depth]
-    # for matmul.
-    query = array_ops.expand_dims(query, 1)
-
-    # Inner product along the query units dimension.
-    # matmul shapes: query is [batch_size, 1, depth] and
-    #                keys is [batch_size, max_time, depth].
-    # the inner product is asked to **transpose keys' inner shape** to get a
-    # batched matmul on:
-    #   [batch_size, 1, depth] . [batch_size, depth, max_time]
-    # resulting in an output shape of:
-    #   [batch_time, 1, max_time].
-    # we then squeeze out the center singleton dimension.
-    score = math_ops.matmul(query, keys, transpose_b=True)
-    score = array_ops.squeeze(score, [1])
+    # Inner product along the query units dimension, expressed as a single
+    # einsum so no expand_dims/squeeze rank shuffling is emitted per step:
+    #   [batch_size, depth] . [batch_size, max_time, depth]
+    # -> [batch_size, max_time]
+    score = tf.einsum('bd,btd->bt', query, keys)
 
     # return tf.nn.l2_normalize(score, dim=1, epsilon=1e-12, name=None)
     return score
 
 
-def _luong_word_score(query, word_keys, scale, size, hierarchy, batch_size):
+def _luong_word_score(query, word_keys, scale, words_per_line, hierarchy, batch_size):
     """Implements Luong-style (multiplicative) scoring function.
 
     This attention has two forms.  The first is standard Luong attention,
@@ -363,27 +459,12 @@ def _luong_word_score(query, word_keys, scale, size, hierarchy, batch_size):
             % (query, depth, word_keys, key_units, key_units))
     dtype = query.dtype
 
-    # Reshape from [batch_size, depth] to [batch_size, 1, depth]
-    # for matmul.
-
-    query = array_ops.expand_dims(query, 1)
-
-    # Inner product along the query units dimension.
-    # matmul shapes: query is [batch_size, 1, depth] and
-    #                keys is [batch_size, max_time, depth].
-    # the inner product is asked to **transpose keys' inner shape** to get a
-    # batched matmul on:
-    #   [batch_size, 1, depth] . [batch_size, depth, max_time]
-    # resulting in an output shape of:
-    #   [batch_time, 1, max_time].
-    # we then squeeze out the center singleton dimension.
-    save_shape = word_keys.get_shape().as_list()
-    word_keys_small = tf.reshape(word_keys,  [batch_size, -1, save_shape[2]*save_shape[3]])
-    word_keys = tf.transpose(word_keys_small, [1, 0, 2])
-    word_keys = tf.reshape(word_keys, [-1, batch_size, save_shape[2], save_shape[3]])
-    def context_fn(key): return array_ops.squeeze(math_ops.matmul(query, key, transpose_b=True), [1])
-    scores = tf.map_fn(context_fn, word_keys)
-    scores = tf.transpose(scores, [1, 0, 2])
+    # Inner product along the query units dimension.  word_keys arrives
+    # pre-flattened as [batch_size, max_memory * max_words, depth] (cached at
+    # mechanism construction), so one batched matmul produces every score,
+    # which we then unflatten back to [batch_size, max_memory, max_words].
+    scores = tf.einsum('bd,btd->bt', query, word_keys)
+    scores = tf.reshape(scores, [batch_size, -1, words_per_line])
 
     # if hierarchy:
     #   return tf.nn.l2_normalize(scores, dim=2, epsilon=1e-12, name=None)
@@ -422,6 +503,7 @@ class CustomAttention(_BaseAttentionMechanism):
                  scale=False,
                  probability_fn=None,
                  score_mask_value=float("-inf"),
+                 compute_dtype=None,
                  name="CustomAttention"):
         """Construct the AttentionMechanism mechanism.
 
@@ -446,8 +528,6 @@ class CustomAttention(_BaseAttentionMechanism):
         # num_units **must** match expected the query depth.
         if probability_fn is None:
             probability_fn = nn_ops.softmax
-
-        def wrapped_probability_fn(score): return probability_fn(score)
         super(CustomAttention, self).__init__(
             query_layer=None,
             line_memory_layer=layers_core.Dense(
@@ -456,10 +536,11 @@ class CustomAttention(_BaseAttentionMechanism):
             #     num_units, name="word_memory_layer", use_bias=False),
             line_memory=line_memory,
             word_memory=word_memory,
-            probability_fn=wrapped_probability_fn,
+            probability_fn=probability_fn,
             line_memory_sequence_length=line_memory_sequence_length,
             word_memory_sequence_length=word_memory_sequence_length,
             score_mask_value=score_mask_value,
+            compute_dtype=compute_dtype,
             name=name)
         self._num_units = num_units
         self._scale = scale
@@ -485,8 +566,29 @@ class CustomAttention(_BaseAttentionMechanism):
             `max_time`).
         """
         with variable_scope.variable_scope(None, "custom_attention", [query]):
-            line_scores = _luong_score(query, self._keys, self._scale)
-            word_scores = _luong_word_score(query, self._word_values, self._scale, self._alignments_size, self._hierarchy, batch_size)
+            if self._combined_keys is not None and self._compute_dtype is None:
+                # one GEMM covers both the line and word scores; split the
+                # result at the (possibly dynamic) line-memory length
+                combined_scores = tf.einsum('bd,btd->bt', query, self._combined_keys)
+                line_scores = array_ops.slice(
+                    combined_scores, [0, 0], tf.stack([-1, self._alignments_size]))
+                word_scores = array_ops.slice(
+                    combined_scores, tf.stack([0, self._alignments_size]), [-1, -1])
+                word_scores = tf.reshape(
+                    word_scores, [batch_size, -1, self._word_alignments_size])
+            elif self._compute_dtype is not None:
+                # run the memory-bound score matmuls in reduced precision,
+                # then bring the scores back up for masking and softmax
+                lp_query = math_ops.cast(query, self._compute_dtype)
+                line_scores = math_ops.cast(
+                    _luong_score(lp_query, self._keys_lp, self._scale), query.dtype)
+                word_scores = math_ops.cast(
+                    _luong_word_score(lp_query, self._word_values_lp, self._scale,
+                                      self._word_alignments_size, self._hierarchy, batch_size),
+                    query.dtype)
+            else:
+                line_scores = _luong_score(query, self._keys, self._scale)
+                word_scores = _luong_word_score(query, self._word_values_flat, self._scale, self._word_alignments_size, self._hierarchy, batch_size)
 
         if self._line_softmax:
             line_alignments = self._soft_weight * self._probability_fn(line_scores)
@@ -502,10 +604,9 @@ class CustomAttention(_BaseAttentionMechanism):
                 word_alignments = tf.nn.l2_normalize(word_scores, dim=[1, 2], epsilon=1e-12, name=None)
 
         if self._hierarchy:
-            temp_word_alignments = tf.transpose(word_alignments, [0, 2, 1])
-            temp_line_alignments = tf.expand_dims(line_alignments, 1)
-            hier_alignments = math_ops.multiply(temp_word_alignments, temp_line_alignments)
-            hier_alignments = tf.transpose(hier_alignments, [0, 2, 1])
+            # the line weight broadcasts along the word axis directly, so the
+            # round trip through [batch, words, lines] layout is unnecessary
+            hier_alignments = word_alignments * tf.expand_dims(line_alignments, 2)
         else:
             shape = word_scores.get_shape().as_list()[-1]
             word_scores = tf.reshape(word_scores, [self._batch_size, -1])
@@ -563,19 +664,12 @@ def _compute_attention(attention_mechanism, batch_size, cell_output, previous_al
     line_alignments, word_alignments, hier_alignments = attention_mechanism(
         cell_output, batch_size, previous_alignments=previous_alignments)
 
-    # Reshape from [batch_size, memory_time] to [batch_size, 1, memory_time]
     # Context is the inner product of alignments and values along the
-    # memory time dimension.
-    # alignments shape is
-    #   [batch_size, 1, memory_time]
-    # attention_mechanism.values shape is
-    #   [batch_size, memory_time, memory_size]
-    # the batched matmul is over memory_time, so the output shape is
-    #   [batch_size, 1, memory_size].
-    # we then squeeze out the singleton dim.
-    expanded_line_alignments = array_ops.expand_dims(line_alignments, 1)
-    line_context = math_ops.matmul(expanded_line_alignments, attention_mechanism.values)
-    line_attention = array_ops.squeeze(line_context, [1])
+    # memory time dimension, written as one einsum:
+    #   [batch_size, memory_time] . [batch_size, memory_time, memory_size]
+    # -> [batch_size, memory_size]
+    line_attention = tf.einsum('bt,btd->bd', line_alignments,
+                               attention_mechanism.values)
 
     return line_attention, hier_alignments
 
@@ -619,7 +713,15 @@ def linear(args, output_size, bias, bias_start=0.0, scope=None):
         if len(args) == 1:
             res = tf.matmul(args[0], matrix)
         else:
-            res = tf.matmul(tf.concat(axis=1, values=args), matrix)
+            # multiply each argument against its row block of the shared
+            # matrix and sum, skipping the feature-axis concat copy; the
+            # variable layout is unchanged so checkpoints stay compatible
+            blocks = []
+            offset = 0
+            for arg, shape in zip(args, shapes):
+                blocks.append(tf.matmul(arg, matrix[offset:offset + shape[1], :]))
+                offset += shape[1]
+            res = tf.add_n(blocks)
         if not bias:
             return res
         bias_term = tf.get_variable(
@@ -637,9 +739,11 @@ class AttentionWrapper(rnn_cell_impl.RNNCell):
                  keep_prob,
                  attention_layer_size=None,
                  alignment_history=False,
+                 alignment_history_size=None,
                  cell_input_fn=None,
                  output_attention=False,
                  initial_cell_state=None,
+                 validate_args=True,
                  name=None):
         """Construct the `AttentionWrapper`.
 
@@ -687,6 +791,10 @@ class AttentionWrapper(rnn_cell_impl.RNNCell):
           alignment_history: Python boolean, whether to store alignment history
             from all time steps in the final output state (currently stored as a
             time major `TensorArray` on which you must call `stack()`).
+          alignment_history_size: (optional) Python int.  When set together
+            with `alignment_history`, the history `TensorArray` is
+            preallocated at this size instead of growing dynamically; use the
+            decoder's maximum iteration count.
           cell_input_fn: (optional) A `callable`.  The default is:
             `lambda inputs, attention: array_ops.concat([inputs, attention], -1)`.
           output_attention: Python bool.  If `True` (default), the output at each
@@ -702,6 +810,9 @@ class AttentionWrapper(rnn_cell_impl.RNNCell):
             now, and the user uses a `batch_size` argument of `zero_state` which
             does not match the batch size of `initial_cell_state`, proper
             behavior is not guaranteed.
+          validate_args: Python bool.  If `False`, the runtime batch-size
+            checks (and their identity copies) are skipped on every step;
+            use for inference graphs where the invariant is already known.
           name: Name to use when creating ops.
 
         Raises:
@@ -767,15 +878,16 @@ class AttentionWrapper(rnn_cell_impl.RNNCell):
         self._cell_input_fn = cell_input_fn
         self._output_attention = output_attention
         self._alignment_history = alignment_history
+        self._alignment_history_size = alignment_history_size
         self._keep_prob = keep_prob
+        self._validate_args = validate_args
+        self._cached_batch_size = None
         with ops.name_scope(name, "AttentionWrapperInit"):
             if initial_cell_state is None:
                 self._initial_cell_state = None
             else:
                 final_state_tensor = nest.flatten(initial_cell_state)[-1]
-                state_batch_size = (
-                    final_state_tensor.shape[0].value
-                    or array_ops.shape(final_state_tensor)[0])
+                state_batch_size = _dim(final_state_tensor, 0)
                 error_message = (
                     "When constructing AttentionWrapper %s: " % self._base_name +
                     "Non-matching batch sizes between the memory "
@@ -790,6 +902,8 @@ class AttentionWrapper(rnn_cell_impl.RNNCell):
                         initial_cell_state)
 
     def _batch_size_checks(self, batch_size, error_message):
+        if not self._validate_args:
+            return []
         return [check_ops.assert_equal(batch_size,
                                        attention_mechanism.batch_size,
                                        message=error_message)
@@ -858,6 +972,9 @@ class AttentionWrapper(rnn_cell_impl.RNNCell):
             to the wrapper object at initialization time.
         """
         with ops.name_scope(type(self).__name__ + "ZeroState", values=[batch_size]):
+            # remember the batch size so call() does not have to re-derive
+            # it from the cell output with a Shape op every step
+            self._cached_batch_size = batch_size
             if self._initial_cell_state is not None:
                 cell_state = self._initial_cell_state
             else:
@@ -870,11 +987,12 @@ class AttentionWrapper(rnn_cell_impl.RNNCell):
                 "been tiled to beam_width via tf.contrib.seq2seq.tile_batch, and "
                 "the batch_size= argument passed to zero_state is "
                 "batch_size * beam_width.")
-            with ops.control_dependencies(
-                    self._batch_size_checks(batch_size, error_message)):
-                cell_state = nest.map_structure(
-                    lambda s: array_ops.identity(s, name="checked_cell_state"),
-                    cell_state)
+            checks = self._batch_size_checks(batch_size, error_message)
+            if checks:
+                with ops.control_dependencies(checks):
+                    cell_state = nest.map_structure(
+                        lambda s: array_ops.identity(s, name="checked_cell_state"),
+                        cell_state)
             return AttentionWrapperState(
                 cell_state=cell_state,
                 time=array_ops.zeros([], dtype=dtypes.int32),
@@ -884,8 +1002,12 @@ class AttentionWrapper(rnn_cell_impl.RNNCell):
                     attention_mechanism.initial_alignments(batch_size, dtype)
                     for attention_mechanism in self._attention_mechanisms),
                 alignment_history=self._item_or_tuple(
-                    tensor_array_ops.TensorArray(dtype=dtype, size=0,
-                                                 dynamic_size=True)
+                    (tensor_array_ops.TensorArray(
+                        dtype=dtype, size=self._alignment_history_size,
+                        dynamic_size=False, clear_after_read=False)
+                     if self._alignment_history_size is not None else
+                     tensor_array_ops.TensorArray(dtype=dtype, size=0,
+                                                  dynamic_size=True))
                     if self._alignment_history else ()
                     for _ in self._attention_mechanisms))
 
@@ -929,8 +1051,9 @@ class AttentionWrapper(rnn_cell_impl.RNNCell):
         cell_state = state.cell_state
         cell_output, next_cell_state = self._cell(cell_inputs, cell_state)
 
-        cell_batch_size = (
-            cell_output.shape[0].value or array_ops.shape(cell_output)[0])
+        cell_batch_size = (self._cached_batch_size
+                           if self._cached_batch_size is not None
+                           else _dim(cell_output, 0))
         error_message = (
             "When applying AttentionWrapper %s: " % self.name +
             "Non-matching batch sizes between the memory "
@@ -938,39 +1061,51 @@ class AttentionWrapper(rnn_cell_impl.RNNCell):
             "the BeamSearchDecoder?  You may need to tile your memory input via "
             "the tf.contrib.seq2seq.tile_batch function with argument "
             "multiple=beam_width.")
-        with ops.control_dependencies(
-                self._batch_size_checks(cell_batch_size, error_message)):
-            cell_output = array_ops.identity(
-                cell_output, name="checked_cell_output")
-
-        if self._is_multi:
-            previous_alignments = state.alignments
-            previous_alignment_history = state.alignment_history
+        checks = self._batch_size_checks(cell_batch_size, error_message)
+        if checks:
+            with ops.control_dependencies(checks):
+                cell_output = array_ops.identity(
+                    cell_output, name="checked_cell_output")
+
+        if not self._is_multi:
+            # fast path for the single mechanism this model always uses:
+            # no list wrapping of the state fields and no _item_or_tuple
+            # unpacking on the way out
+            attention, hier_alignments = _compute_attention(
+                self._attention_mechanisms[0], cell_batch_size, cell_output,
+                state.alignments,
+                self._attention_layers[0] if self._attention_layers else None)
+            alignment_history = state.alignment_history.write(
+                state.time, hier_alignments) if self._alignment_history else ()
+            next_state = AttentionWrapperState(
+                time=state.time + 1,
+                cell_state=next_cell_state,
+                attention=attention,
+                alignments=hier_alignments,
+                alignment_history=alignment_history)
         else:
-            previous_alignments = [state.alignments]
-            previous_alignment_history = [state.alignment_history]
-
-        all_alignments = []
-        all_attentions = []
-        all_histories = []
-        for i, attention_mechanism in enumerate(self._attention_mechanisms):
-            line_attention, hier_alignments = _compute_attention(
-                attention_mechanism, cell_batch_size, cell_output, previous_alignments[i],
-                self._attention_layers[i] if self._attention_layers else None)
-            alignment_history = previous_alignment_history[i].write(
-                state.time, alignments) if self._alignment_history else ()
-
-            all_alignments.append(hier_alignments)
-            all_histories.append(alignment_history)
-            all_attentions.append(line_attention)
-
-        attention = array_ops.concat(all_attentions, 1)
-        next_state = AttentionWrapperState(
-            time=state.time + 1,
-            cell_state=next_cell_state,
-            attention=attention,
-            alignments=self._item_or_tuple(all_alignments),
-            alignment_history=self._item_or_tuple(all_histories))
+            all_alignments = []
+            all_attentions = []
+            all_histories = []
+            for i, attention_mechanism in enumerate(self._attention_mechanisms):
+                line_attention, hier_alignments = _compute_attention(
+                    attention_mechanism, cell_batch_size, cell_output,
+                    state.alignments[i],
+                    self._attention_layers[i] if self._attention_layers else None)
+                alignment_history = state.alignment_history[i].write(
+                    state.time, hier_alignments) if self._alignment_history else ()
+
+                all_alignments.append(hier_alignments)
+                all_histories.append(alignment_history)
+                all_attentions.append(line_attention)
+
+            attention = array_ops.concat(all_attentions, 1)
+            next_state = AttentionWrapperState(
+                time=state.time + 1,
+                cell_state=next_cell_state,
+                attention=attention,
+                alignments=tuple(all_alignments),
+                alignment_history=tuple(all_histories))
 
         p_gens = tf.sigmoid(linear([cell_state, cell_inputs], 1, True))
 
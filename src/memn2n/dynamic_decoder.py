@@ -20,6 +20,7 @@ from __future__ import print_function
 
 import abc
 import collections
+import os
 import six
 import tensorflow as tf
 
@@ -46,6 +47,11 @@ __all__ = ["BasicDecoder", "dynamic_decode"]
 
 _transpose_batch_time = rnn._transpose_batch_time  # pylint: disable=protected-access
 
+# Structure checks in the decode body are pure Python traversals repeated on
+# every graph build of the loop; set BOSSNET_DEBUG_ASSERTS=1 to re-enable
+# them when debugging a decoder change.
+_ENABLE_ASSERTS = os.environ.get("BOSSNET_DEBUG_ASSERTS", "0") != "0"
+
 
 class BasicDecoderOutput(
         collections.namedtuple("BasicDecoderOutput", ("rnn_output", "sample_id"))):
@@ -266,11 +272,13 @@ def dynamic_decode(decoder,
         if varscope.caching_device is None:
             varscope.set_caching_device(lambda op: op.device)
 
+        maximum_iterations_static = None
         if maximum_iterations is not None:
             maximum_iterations = ops.convert_to_tensor(
                 maximum_iterations, dtype=dtypes.int32, name="maximum_iterations")
             if maximum_iterations.get_shape().ndims != 0:
                 raise ValueError("maximum_iterations must be a scalar")
+            maximum_iterations_static = tensor_util.constant_value(maximum_iterations)
 
         initial_finished, initial_inputs, initial_state = decoder.initialize()
 
@@ -295,6 +303,15 @@ def dynamic_decode(decoder,
                 return tensor_shape.TensorShape([batch_size]).concatenate(from_shape)
 
         def _create_ta(s, d):
+            if maximum_iterations_static is not None:
+                # the step bound is known at graph build time, so the arrays
+                # can be preallocated instead of grown write by write
+                return tensor_array_ops.TensorArray(
+                    dtype=d,
+                    size=int(maximum_iterations_static),
+                    dynamic_size=False,
+                    clear_after_read=False,
+                    element_shape=_shape(decoder.batch_size, s))
             return tensor_array_ops.TensorArray(
                 dtype=d,
                 size=0,
@@ -304,10 +321,11 @@ def dynamic_decode(decoder,
 
         initial_outputs_ta = nest.map_structure(_create_ta, decoder.output_size,
                                                 decoder.output_dtype)
-        initial_attention = nest.map_structure(_create_ta, tensor_shape.TensorShape(None),
-                                               dtypes.float32)
-        initial_p_gens = nest.map_structure(_create_ta, tensor_shape.TensorShape(1),
-                                            dtypes.float32)
+        # attention and p_gens are single tensors, not nested structures
+        initial_attention = _create_ta(tensor_shape.TensorShape(None),
+                                       dtypes.float32)
+        initial_p_gens = _create_ta(tensor_shape.TensorShape(1),
+                                    dtypes.float32)
 
         def condition(unused_time, unused_outputs_ta, unused_state, unused_inputs,
                       finished, unused_sequence_lengths, p_gens, attention):
@@ -337,16 +355,28 @@ def dynamic_decode(decoder,
                 array_ops.fill(array_ops.shape(sequence_lengths), time + 1),
                 sequence_lengths)
 
-            nest.assert_same_structure(state, decoder_state)
-            nest.assert_same_structure(outputs_ta, next_outputs)
-            nest.assert_same_structure(inputs, next_inputs)
-            nest.assert_same_structure(attention, next_attention)
-            nest.assert_same_structure(p_gens, next_p_gens)
+            if _ENABLE_ASSERTS:
+                nest.assert_same_structure(state, decoder_state)
+                nest.assert_same_structure(outputs_ta, next_outputs)
+                nest.assert_same_structure(inputs, next_inputs)
+                nest.assert_same_structure(attention, next_attention)
+                nest.assert_same_structure(p_gens, next_p_gens)
+
+            # for float tensors the finished select can be an arithmetic
+            # blend, which fuses with neighboring ops instead of a branchy
+            # select kernel; everything else keeps the where
+            def _finished_blend(keep, replace):
+                ndims = keep.shape.ndims
+                if keep.dtype.is_floating and ndims:
+                    mask = math_ops.cast(finished, keep.dtype)
+                    mask = array_ops.reshape(mask, [-1] + [1] * (ndims - 1))
+                    return keep * (1.0 - mask) + replace * mask
+                return array_ops.where(finished, replace, keep)
 
             # Zero out output values past finish
             if impute_finished:
                 emit = nest.map_structure(
-                    lambda out, zero: array_ops.where(finished, zero, out),
+                    lambda out, zero: _finished_blend(out, zero),
                     next_outputs,
                     zero_outputs)
             else:
@@ -360,19 +390,21 @@ def dynamic_decode(decoder,
                 else:
                     new.set_shape(cur.shape)
                     pass_through = (new.shape.ndims == 0)
-                return new if pass_through else array_ops.where(finished, cur, new)
+                return new if pass_through else _finished_blend(new, cur)
 
             if impute_finished:
                 next_state = nest.map_structure(_maybe_copy_state, decoder_state, state)
             else:
                 next_state = decoder_state
 
-            outputs_ta = nest.map_structure(lambda ta, out: ta.write(time, out),
-                                            outputs_ta, emit)
-            attention = nest.map_structure(lambda ta, out: ta.write(time, out),
-                                           attention, next_attention)
-            p_gens = nest.map_structure(lambda ta, out: ta.write(time, out),
-                                        p_gens, next_p_gens)
+            # the output structure is a fixed two-field namedtuple and the
+            # attention/p_gens arrays are bare tensors, so the writes go
+            # through directly instead of via nest traversals
+            outputs_ta = BasicDecoderOutput(
+                outputs_ta.rnn_output.write(time, emit.rnn_output),
+                outputs_ta.sample_id.write(time, emit.sample_id))
+            attention = attention.write(time, next_attention)
+            p_gens = p_gens.write(time, next_p_gens)
             return (time + 1, outputs_ta, next_state, next_inputs, next_finished, next_sequence_lengths, p_gens, attention)
 
         res = control_flow_ops.while_loop(
@@ -390,13 +422,23 @@ def dynamic_decode(decoder,
         final_p_gens = res[6]
         final_attention = res[7]
 
-        final_outputs = nest.map_structure(lambda ta: ta.stack(), final_outputs_ta)
-        final_attention = nest.map_structure(lambda ta: ta.stack(), final_attention)
-        final_p_gens = nest.map_structure(lambda ta: ta.stack(), final_p_gens)
+        if maximum_iterations_static is not None:
+            # preallocated arrays may have unwritten slots past the final
+            # step, so read back only the written prefix
+            read_indices = math_ops.range(res[0])
+            def _read_ta(ta): return ta.gather(read_indices)
+        else:
+            def _read_ta(ta): return ta.stack()
+        final_outputs = BasicDecoderOutput(_read_ta(final_outputs_ta.rnn_output),
+                                           _read_ta(final_outputs_ta.sample_id))
+        final_attention = _read_ta(final_attention)
+        final_p_gens = _read_ta(final_p_gens)
 
         if not output_time_major:
-            final_outputs = nest.map_structure(_transpose_batch_time, final_outputs)
-            final_p_gens = nest.map_structure(_transpose_batch_time, final_p_gens)
-            final_attention = nest.map_structure(_transpose_batch_time, final_attention)
+            final_outputs = BasicDecoderOutput(
+                _transpose_batch_time(final_outputs.rnn_output),
+                _transpose_batch_time(final_outputs.sample_id))
+            final_p_gens = _transpose_batch_time(final_p_gens)
+            final_attention = _transpose_batch_time(final_attention)
 
     return final_outputs, final_p_gens
@@ -1,24 +1,129 @@
 import numpy as np
-import random
+import os
+from concurrent.futures import ProcessPoolExecutor
 
 PAD_INDEX = 0
 UNK_INDEX = 1
 GO_SYMBOL_INDEX = 2
 EOS_INDEX = 3
 
+# Story vectorization is farmed out to worker processes above this corpus size
+PARALLEL_MIN_STORIES = 2048
+
+
+def _vectorize_story(story, memory_size, max_memory_size, sentence_size, word_idx, decode_idx, decode_vocab_size, build_readable=True, sentence_cache=None):
+    '''
+            Vectorize a single story; module-level so worker processes can run it
+    '''
+    story_sentences = []    # Encoded Sentences of Single Story (unpadded)
+    sentence_sizes = []     # List of lengths of each sentence of a Single Story
+    story_string = []       # Readable Sentences of a Single Story
+    oov_ids = []            # The ids of words in OOV index for copy (unpadded)
+    oov_words = []          # The OOV words in a Single Story
+    oov_word_to_id = {}     # OOV word -> copy id, to avoid linear scans
+
+    if sentence_cache is None:
+        sentence_cache = {}
+
+    # hoist globals and bound methods out of the token loops
+    unk_index = UNK_INDEX
+    word_idx_get = word_idx.get
+    decode_idx_get = decode_idx.get
+    oov_word_to_id_get = oov_word_to_id.get
+    cache_get = sentence_cache.get
+
+    for sentence in story:
+        # identical turns repeat across dialogs; reuse their encoded forms
+        key = tuple(sentence)
+        cached = cache_get(key)
+        if cached is None:
+            sentence_ids = []
+            sentence_string = []
+            for w in sentence:
+                sentence_ids.append(word_idx_get(w, unk_index))
+                if build_readable:
+                    sentence_string.append(str(w))
+            if build_readable:
+                sentence_string += [''] * max(0, sentence_size - len(sentence))
+            sentence_cache[key] = (sentence_ids, sentence_string)
+        else:
+            sentence_ids, sentence_string = cached
+
+        # OOV copy ids depend on story state, so they cannot be memoized
+        oov_sentence_ids = []
+        for w in sentence:
+            oov_id = decode_idx_get(w)
+            if oov_id is None:
+                oov_id = oov_word_to_id_get(w)
+                if oov_id is None:
+                    oov_id = decode_vocab_size + len(oov_words)
+                    oov_word_to_id[w] = oov_id
+                    oov_words.append(w)
+            oov_sentence_ids.append(oov_id)
+
+        story_sentences.append(sentence_ids)
+        sentence_sizes.append(len(sentence))
+        if build_readable:
+            story_string.append(sentence_string)
+        oov_ids.append(oov_sentence_ids)
+
+    # take only the most recent sentences that fit in memory
+    if len(story_sentences) > max_memory_size:
+        story_sentences = story_sentences[-max_memory_size:]
+        sentence_sizes = sentence_sizes[-max_memory_size:]
+        story_string = story_string[-max_memory_size:]
+        oov_ids = oov_ids[-max_memory_size:]
+    else:  # pad to memory_size
+        mem_pad = max(0, memory_size - len(story_sentences))
+        for _ in range(mem_pad):
+            sentence_sizes.append(0)
+            if build_readable:
+                story_string.append([''] * sentence_size)
+
+    # fill preallocated int32 buffers; padding stays zero
+    story_arr = np.zeros((len(sentence_sizes), sentence_size), dtype=np.int32)
+    oov_arr = np.zeros((len(sentence_sizes), sentence_size), dtype=np.int32)
+    for row, (sentence_ids, oov_sentence_ids) in enumerate(zip(story_sentences, oov_ids)):
+        story_arr[row, :len(sentence_ids)] = sentence_ids
+        oov_arr[row, :len(oov_sentence_ids)] = oov_sentence_ids
+
+    return (story_arr,
+            len(story),
+            np.asarray(sentence_sizes, dtype=np.int32),
+            np.array(story_string) if build_readable else None,
+            oov_arr,
+            len(oov_words),
+            oov_words,
+            oov_word_to_id)
+
+
+def _vectorize_story_chunk(stories, memory_sizes, max_memory_size, sentence_size, word_idx, decode_idx, decode_vocab_size, build_readable=True):
+    '''
+            Vectorize a contiguous chunk of stories, preserving order
+    '''
+    sentence_cache = {}
+    return [_vectorize_story(story, memory_size, max_memory_size, sentence_size,
+                             word_idx, decode_idx, decode_vocab_size, build_readable,
+                             sentence_cache)
+            for story, memory_size in zip(stories, memory_sizes)]
+
 
 class Data(object):
 
-    def __init__(self, data, args, glob):
+    def __init__(self, data, args, glob, build_readable=True):
+        self._build_readable = build_readable
         self._db_vocab_id = glob['word_idx'].get('$db', -1)
         self._decode_vocab_size = len(glob['decode_idx'])
+        # frozen views for membership tests; the dicts stay for value lookup
+        self._decoder_vocab_words = frozenset(glob['decode_idx'])
+        self._decoder_vocab_ids = frozenset(glob['idx_decode'])
 
         # Sort Dialogs based on turn_id
         self._stories_ext, self._queries_ext, self._answers_ext, self._dialog_ids = \
             self._extract_data_items(data)
 
         # Process Stories
-        self._stories, self._story_lengths, self._story_sizes, self._read_stories, self._oov_ids, self._oov_sizes, self._oov_words = \
+        self._stories, self._story_lengths, self._story_sizes, self._read_stories, self._oov_ids, self._oov_sizes, self._oov_words, self._oov_word_to_id = \
             self._vectorize_stories(self._stories_ext, args, glob)
 
         # Process Queries
@@ -41,6 +146,26 @@ class Data(object):
         self._entities = \
             self._get_entity_indecies(self._read_answers, self._entity_set)
 
+        # Per-example fields, sliced as one group when building a Batch
+        self._fields = {
+            'stories': self._stories,
+            'queries': self._queries,
+            'answers': self._answers,
+            'answers_emb_lookup': self._answers_emb_lookup,
+            'story_sizes': self._story_sizes,
+            'query_sizes': self._query_sizes,
+            'answer_sizes': self._answer_sizes,
+            'read_stories': self._read_stories,
+            'read_queries': self._read_queries,
+            'read_answers': self._read_answers,
+            'oov_ids': self._oov_ids,
+            'oov_sizes': self._oov_sizes,
+            'oov_words': self._oov_words,
+            'dialog_ids': self._dialog_ids,
+            'intersection_set': self._intersection_set,
+            'entities': self._entities,
+        }
+
     ## Dialogs ##
     @property
     def stories(self):
@@ -139,10 +264,15 @@ class Data(object):
 
     def _extract_data_items(self, data):
         data.sort(key=lambda x: len(x[0]), reverse=True)
-        stories = [x[0] for x in data]
-        queries = [x[1] for x in data]
-        answers = [x[2] for x in data]
-        dialog_id = [x[3] for x in data]
+        stories = []
+        queries = []
+        answers = []
+        dialog_id = []
+        for story, query, answer, did, _ in data:
+            stories.append(story)
+            queries.append(query)
+            answers.append(answer)
+            dialog_id.append(did)
         return stories, queries, answers, dialog_id
 
     def _vectorize_stories(self, stories, args, glob):
@@ -156,104 +286,95 @@ class Data(object):
         self._oov_ids = []              # The index of words for copy in Response-Decoder
         self._oov_sizes = []            # The size of OOV words set in Response-Decoder
         self._oov_words = []            # The OOV words in the Stories
+        self._oov_word_to_id = []       # Per-story OOV word -> copy id maps
 
+        # memory_size depends on the batch leader, so fix it per story up front
+        memory_sizes = []
+        memory_size = 1
         for i, story in enumerate(stories):
             if i % args.batch_size == 0:
                 memory_size = max(1, min(args.memory_size, len(story)))
-            story_sentences = []    # Encoded Sentences of Single Story
-            sentence_sizes = []     # List of lengths of each sentence of a Single Story
-            story_string = []       # Readable Sentences of a Single Story
-            oov_ids = []            # The ids of words in OOV index for copy
-            oov_words = []          # The OOV words in a Single Story
-
-            for sentence in story:
-                pad = max(0, glob['sentence_size'] - len(sentence))
-                story_sentences.append([glob['word_idx'][w] if w in glob['word_idx'] else UNK_INDEX for w in sentence] + [0] * pad)
-                sentence_sizes.append(len(sentence))
-                story_string.append([str(x) for x in sentence] + [''] * pad)
-
-                oov_sentence_ids = []
-                for w in sentence:
-                    if w not in glob['decode_idx']:
-                        if w not in oov_words:
-                            oov_sentence_ids.append(self._decode_vocab_size + len(oov_words))
-                            oov_words.append(w)
-                        else:
-                            oov_sentence_ids.append(self._decode_vocab_size + oov_words.index(w))
-                    else:
-                        oov_sentence_ids.append(glob['decode_idx'][w])
-                oov_sentence_ids = oov_sentence_ids + [PAD_INDEX] * pad
-                oov_ids.append(oov_sentence_ids)
-
-            # take only the most recent sentences that fit in memory
-            if len(story_sentences) > args.memory_size:
-                story_sentences = story_sentences[::-1][:args.memory_size][::-1]
-                sentence_sizes = sentence_sizes[::-1][:args.memory_size][::-1]
-                story_string = story_string[::-1][:args.memory_size][::-1]
-                oov_ids = oov_ids[::-1][:args.memory_size][::-1]
-            else:  # pad to memory_size
-                mem_pad = max(0, memory_size - len(story_sentences))
-                for _ in range(mem_pad):
-                    story_sentences.append([0] * glob['sentence_size'])
-                    sentence_sizes.append(0)
-                    story_string.append([''] * glob['sentence_size'])
-                    oov_ids.append([0] * glob['sentence_size'])
-
-            self._stories.append(np.array(story_sentences))
-            self._story_lengths.append(len(story))
-            self._story_sizes.append(np.array(sentence_sizes))
-            self._read_stories.append(np.array(story_string))
-            self._oov_ids.append(np.array(oov_ids))
-            self._oov_sizes.append(np.array(len(oov_words)))
+            memory_sizes.append(memory_size)
+
+        workers = os.cpu_count() or 1
+        if len(stories) >= PARALLEL_MIN_STORIES and workers > 1:
+            chunk_size = (len(stories) + workers - 1) // workers
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_vectorize_story_chunk,
+                                           stories[start:start + chunk_size],
+                                           memory_sizes[start:start + chunk_size],
+                                           args.memory_size, glob['sentence_size'],
+                                           glob['word_idx'], glob['decode_idx'],
+                                           self._decode_vocab_size, self._build_readable)
+                           for start in range(0, len(stories), chunk_size)]
+                results = [item for future in futures for item in future.result()]
+        else:
+            results = _vectorize_story_chunk(stories, memory_sizes,
+                                             args.memory_size, glob['sentence_size'],
+                                             glob['word_idx'], glob['decode_idx'],
+                                             self._decode_vocab_size, self._build_readable)
+
+        if not self._build_readable:
+            self._read_stories = None
+        for story_arr, length, sizes_arr, read_arr, oov_arr, oov_size, oov_words, oov_word_to_id in results:
+            self._stories.append(story_arr)
+            self._story_lengths.append(length)
+            self._story_sizes.append(sizes_arr)
+            if self._build_readable:
+                self._read_stories.append(read_arr)
+            self._oov_ids.append(oov_arr)
+            self._oov_sizes.append(oov_size)
             self._oov_words.append(oov_words)
-        return self._stories, self._story_lengths, self._story_sizes, self._read_stories, self._oov_ids, self._oov_sizes, self._oov_words
+            self._oov_word_to_id.append(oov_word_to_id)
+        # one packed vector instead of a zero-dim array per story
+        self._oov_sizes = np.asarray(self._oov_sizes, dtype=np.int32)
+        return self._stories, self._story_lengths, self._story_sizes, self._read_stories, self._oov_ids, self._oov_sizes, self._oov_words, self._oov_word_to_id
 
     def _vectorize_queries(self, queries, glob):
         '''
                 Maps each query into word and character tokens and assigns them ids
         '''
-        self._queries = []
-        self._query_sizes = []
+        self._queries = np.zeros((len(queries), glob['sentence_size']), dtype=np.int32)
+        self._query_sizes = np.zeros((len(queries), 1), dtype=np.int32)
         self._read_queries = []
 
+        word_idx = glob['word_idx']
+        if not self._build_readable:
+            self._read_queries = None
         for i, query in enumerate(queries):
-            pad = max(0, glob['sentence_size'] - len(query))
-            query_sentence = [glob['word_idx'][w] if w in glob['word_idx'] else UNK_INDEX for w in query] + [0] * pad
-
-            self._queries.append(np.array(query_sentence))
-            self._query_sizes.append(np.array([len(query)]))
-            self._read_queries.append(' '.join([str(x) for x in query]))
+            self._queries[i, :len(query)] = [word_idx.get(w, UNK_INDEX) for w in query]
+            self._query_sizes[i, 0] = len(query)
+            if self._build_readable:
+                self._read_queries.append(' '.join([str(x) for x in query]))
         return self._queries, self._query_sizes, self._read_queries
 
     def _vectorize_answers(self, answers, glob):
         '''
                 Maps each story into word tokens and assigns them ids
         '''
-        self._answers = []
-        self._answer_sizes = []
+        candidate_sentence_size = glob['candidate_sentence_size']
+        self._answers = np.zeros((len(answers), candidate_sentence_size), dtype=np.int32)
+        self._answer_sizes = np.zeros((len(answers), 1), dtype=np.int32)
         self._read_answers = []
-        self._answers_emb_lookup = []
+        self._answers_emb_lookup = np.zeros((len(answers), candidate_sentence_size), dtype=np.int32)
 
+        decode_idx = glob['decode_idx']
         for i, answer in enumerate(answers):
-            pad = max(0, glob['candidate_sentence_size'] - len(answer) - 1)
-            answer_sentence = []
-            a_emb_lookup = []
-            for w in answer:
-                if w in glob['decode_idx']:
-                    answer_sentence.append(glob['decode_idx'][w])
-                    a_emb_lookup.append(glob['decode_idx'][w])
-                elif w in self._oov_words[i]:
-                    answer_sentence.append(self._decode_vocab_size + self._oov_words[i].index(w))
-                    a_emb_lookup.append(UNK_INDEX)
+            answer_sentence = self._answers[i]
+            a_emb_lookup = self._answers_emb_lookup[i]
+            oov_map = self._oov_word_to_id[i]
+            for j, w in enumerate(answer):
+                decode_id = decode_idx.get(w)
+                if decode_id is not None:
+                    answer_sentence[j] = decode_id
+                    a_emb_lookup[j] = decode_id
                 else:
-                    answer_sentence.append(UNK_INDEX)
-                    a_emb_lookup.append(UNK_INDEX)
-            answer_sentence = answer_sentence + [EOS_INDEX] + [PAD_INDEX] * pad
-            a_emb_lookup = a_emb_lookup + [EOS_INDEX] + [PAD_INDEX] * pad
-            self._answers.append(np.array(answer_sentence))
-            self._answer_sizes.append(np.array([len(answer) + 1]))
+                    answer_sentence[j] = oov_map.get(w, UNK_INDEX)
+                    a_emb_lookup[j] = UNK_INDEX
+            answer_sentence[len(answer)] = EOS_INDEX
+            a_emb_lookup[len(answer)] = EOS_INDEX
+            self._answer_sizes[i, 0] = len(answer) + 1
             self._read_answers.append(' '.join([str(x) for x in answer]))
-            self._answers_emb_lookup.append(np.array(a_emb_lookup))
         return self._answers, self._answer_sizes, self._read_answers, self._answers_emb_lookup
 
     def _populate_entity_set(self, glob, stories, answers):
@@ -283,19 +404,19 @@ class Data(object):
         '''
                 Create a mask which tracks the postions to copy a DB word
         '''
-        self._intersection_set = []
+        decoder_vocab_ids = self._decoder_vocab_ids
+        self._intersection_set = np.zeros((len(answers), answers.shape[1]), dtype=np.float32)
         for i, answer in enumerate(answers):
 
             vocab = set(answer).intersection(entity_ids)
-            dialog_mask = [0.0 if (x in vocab or x not in glob['idx_decode']) else 1.0 for x in answer]
-            self._intersection_set.append(np.array(dialog_mask))
+            self._intersection_set[i] = [0.0 if (x in vocab or x not in decoder_vocab_ids) else 1.0 for x in answer]
         return self._intersection_set
 
     def _get_entity_indecies(self, read_answers, entity_set):
         '''
                 Get list of entity indecies in each Dialog Response
         '''
-        self._entities = [np.array([i for i, word in enumerate(ans.split()) if word in entity_set]) for ans in read_answers]
+        self._entities = [np.array([i for i, word in enumerate(ans.split()) if word in entity_set], dtype=np.int32) for ans in read_answers]
         return self._entities
 
 
@@ -303,37 +424,8 @@ class Batch(Data):
 
     def __init__(self, data, start, end, args, train=False):
 
-        self._stories = data.stories[start:end]
-
-        self._queries = data.queries[start:end]
-
-        self._answers = data.answers[start:end]
-
-        self._answers_emb_lookup = data.answers_emb_lookup[start:end]
-
-        self._story_sizes = data.story_sizes[start:end]
-
-        self._query_sizes = data.query_sizes[start:end]
-
-        self._answer_sizes = data.answer_sizes[start:end]
-
-        self._read_stories = data.readable_stories[start:end]
-
-        self._read_queries = data.readable_queries[start:end]
-
-        self._read_answers = data.readable_answers[start:end]
-
-        self._oov_ids = data.oov_ids[start:end]
-
-        self._oov_sizes = data.oov_sizes[start:end]
-
-        self._oov_words = data.oov_words[start:end]
-
-        self._dialog_ids = data.dialog_ids[start:end]
-
-        self._intersection_set = data.intersection_set[start:end]
-
-        self._entities = data.entities[start:end]
+        for name, values in data._fields.items():
+            setattr(self, '_' + name, values[start:end] if values is not None else None)
 
         self._entity_set = data.entity_set
 
@@ -350,14 +442,14 @@ class Batch(Data):
         '''
         new_stories = []
 
+        entity_ids = np.fromiter(self._encoder_entity_ids, dtype=np.int64, count=len(self._encoder_entity_ids))
         for k, story in enumerate(stories):
             new_story = story.copy()
-            for i in range(new_story.shape[0]):
-                if db_vocab_id not in new_story[i]:
-                    for j in range(new_story.shape[1]):
-                        if new_story[i][j] in self._encoder_entity_ids:
-                            sample = random.uniform(0, 1)
-                            if sample < word_drop_prob:
-                                new_story[i][j] = UNK_INDEX
+            # only rows without a db marker are eligible for dropout
+            eligible_rows = ~np.any(new_story == db_vocab_id, axis=1)
+            drop = np.isin(new_story, entity_ids)
+            drop &= eligible_rows[:, None]
+            drop &= np.random.uniform(size=new_story.shape) < word_drop_prob
+            new_story[drop] = UNK_INDEX
             new_stories.append(new_story)
         return new_stories
@@ -162,7 +162,7 @@ def merge(ordered, gold_out=True):
 
 def evaluate(args, glob, predictions, data):
     preds = predictions
-    golds = data.answers.copy()
+    golds = [list(gold) for gold in data.answers]
     word_map = glob['idx_decode']
     index_map = glob['decode_idx']
     entities = data.entities
@@ -27,6 +27,9 @@ flags.DEFINE_boolean("p_gen_loss", True, 'if True, uses additional p_gen loss du
 flags.DEFINE_boolean("hierarchy", True, "if True, uses hierarchy pointer attention")
 flags.DEFINE_boolean("rnn", True, "if True, uses bi-directional-rnn to encode, else Bag of Words")
 
+# Performance
+flags.DEFINE_boolean("xla_jit", False, "if True, enables XLA JIT compilation for the session")
+
 # Output and Evaluation Specifications
 flags.DEFINE_integer("evaluation_interval", 1, "Evaluate and print results every x epochs")
 flags.DEFINE_boolean("bleu_score", False, 'if True, uses BLUE word score to compute best model')
@@ -72,6 +75,9 @@ def print_params(logging, args):
     logging.info('[{}] : {}'.format('hierarchy', args.hierarchy))
     logging.info('[{}] : {}'.format('rnn', args.rnn))
 
+    print('\n# {}'.format('Performance'))
+    logging.info('[{}] : {}'.format('xla_jit', args.xla_jit))
+
     print('\n# {}'.format('Evaluation Type'))
     logging.info('[{}] : {}'.format('evaluation_interval', args.evaluation_interval))
     logging.info('[{}] : {}'.format('bleu_score', args.bleu_score))